@@ -35,6 +35,7 @@ const char* server = "http://192.168.8.130:5000/esp/update";  // Server endpoint
 #define BUZZER_BLINK_INTERVAL 500    // Buzzer blink rate during high danger
 #define EMERGENCY_CHECK_INTERVAL 1000 // How often to check server for emergency commands
 #define SERVO_CHECK_INTERVAL 1000    // How often to check server for servo commands
+#define CONFIG_CHECK_INTERVAL 60000  // How often to check server for a new reporting policy
 
 // Global Variables
 unsigned long lastSendTime = 0;          // Last time data was sent to server
@@ -48,6 +49,26 @@ bool buzzerState = false;                 // Current buzzer state
 bool currentButtonPressed = false;        // Current button state
 bool emergencyState = false;              // Emergency mode status
 bool servoState = false;                  // Current servo position (false=closed, true=open)
+bool reportNow = false;                   // Send a reading immediately (after applying a command)
+String emergencyTrace = "";               // Trace ID of the last applied emergency command
+String servoTrace = "";                   // Trace ID of the last applied servo command
+unsigned long sendSeq = 0;                // Sequence number of the last reading sent
+unsigned long ackSeq = 0;                 // Last reading the server answered (0 = none yet)
+unsigned long ackMs = 0;                  // millis() when that answer arrived
+
+// Report-by-exception policy (from /esp/config). Until one is fetched the
+// device reports every SEND_INTERVAL, as before.
+unsigned long lastConfigCheck = 0;        // Last time the policy was checked
+int policyVersion = 0;                    // Version of the policy in use (0 = none yet)
+int reportDeadband = 0;                   // Report when danger moves this much
+unsigned long minReportInterval = SEND_INTERVAL;  // Never report more often than this
+unsigned long maxReportInterval = SEND_INTERVAL;  // Always report at least this often
+bool reportOnBandChange = false;          // Report at once on a danger band crossing
+int bandThresholds[2] = {40, 70};         // Danger band boundaries
+int lastSentDanger = -1;                  // Values in the last reading sent
+int lastSentBand = -1;
+bool lastSentEmergency = false;
+bool lastSentServo = false;
 Servo myServo;                            // Servo object
 
 void setup() {
@@ -112,8 +133,15 @@ void loop() {
   // Control outputs based on danger level (unless in emergency mode)
   controlOutputs(dangerLevel, currentTime);
 
-  // Send data to server at regular intervals
-  if (currentTime - lastSendTime >= SEND_INTERVAL) {
+  // Check for a new reporting policy periodically (retry sooner until the first one arrives)
+  if (currentTime - lastConfigCheck >= (policyVersion == 0 ? SEND_INTERVAL : CONFIG_CHECK_INTERVAL)) {
+    checkReportPolicy();
+    lastConfigCheck = currentTime;
+  }
+
+  // Send data when the reporting policy says so, or right away after a
+  // command so the backend can time click-to-actuation latency
+  if (reportNow || shouldReport(dangerLevel, currentTime)) {
     if (WiFi.status() == WL_CONNECTED) {
       sendSensorData(potValue, dangerLevel, emergencyState);
     } else {
@@ -121,6 +149,11 @@ void loop() {
       connectToWiFi();  // Try to reconnect if connection lost
     }
     lastSendTime = currentTime;
+    reportNow = false;
+    lastSentDanger = dangerLevel;
+    lastSentBand = dangerBand(dangerLevel);
+    lastSentEmergency = emergencyState;
+    lastSentServo = servoState;
   }
 
   delay(10);  // Small delay to prevent watchdog timer issues
@@ -242,7 +275,7 @@ void checkEmergencyStatus() {
 
   if (httpCode == HTTP_CODE_OK) {
     String payload = http.getString();
-    DynamicJsonDocument doc(128);
+    DynamicJsonDocument doc(256);
     deserializeJson(doc, payload);
 
     // Get emergency state from server
@@ -252,6 +285,9 @@ void checkEmergencyStatus() {
     if (serverEmergencyState != emergencyState) {
       emergencyState = serverEmergencyState;
       updateEmergencyOutputs();
+      // Echo the command's trace ID in the next (immediate) reading
+      emergencyTrace = doc["emergency_trace"] | "";
+      reportNow = true;
     }
   }
   http.end();
@@ -269,7 +305,7 @@ void checkServoStatus() {
 
   if (httpCode == HTTP_CODE_OK) {
     String payload = http.getString();
-    DynamicJsonDocument doc(128);
+    DynamicJsonDocument doc(256);
     deserializeJson(doc, payload);
 
     // Get servo state from server
@@ -278,6 +314,66 @@ void checkServoStatus() {
     // Update servo if state changed and not in emergency
     if (serverServoState != servoState && !emergencyState) {
       controlServo(serverServoState);
+      // Echo the command's trace ID in the next (immediate) reading
+      servoTrace = doc["trace_id"] | "";
+      reportNow = true;
+    }
+  }
+  http.end();
+}
+
+/**
+ * Returns the danger band (0 = normal, 1 = warning, 2 = danger) for a level
+ */
+int dangerBand(int dangerLevel) {
+  int band = 0;
+  for (int i = 0; i < 2; i++) {
+    if (dangerLevel > bandThresholds[i]) band++;
+  }
+  return band;
+}
+
+/**
+ * Decides whether a reading is due under the report-by-exception policy
+ * @param dangerLevel - Current danger level (0-100)
+ * @param currentTime - Current time from millis()
+ */
+bool shouldReport(int dangerLevel, unsigned long currentTime) {
+  unsigned long elapsed = currentTime - lastSendTime;
+
+  // Heartbeat so the server knows the device is alive
+  if (elapsed >= maxReportInterval) return true;
+  // Band crossings are reported immediately
+  if (reportOnBandChange && dangerBand(dangerLevel) != lastSentBand) return true;
+  if (elapsed < minReportInterval) return false;
+  // Output state changes and moves beyond the deadband
+  if (emergencyState != lastSentEmergency || servoState != lastSentServo) return true;
+  return abs(dangerLevel - lastSentDanger) >= reportDeadband && reportDeadband > 0;
+}
+
+/**
+ * Fetches the reporting policy; the server answers 304 while it is unchanged
+ */
+void checkReportPolicy() {
+  if (WiFi.status() != WL_CONNECTED) return;
+
+  HTTPClient http;
+  http.begin("http://192.168.8.130:5000/esp/config?version=" + String(policyVersion));
+  int httpCode = http.GET();
+
+  if (httpCode == HTTP_CODE_OK) {
+    String payload = http.getString();
+    DynamicJsonDocument doc(384);
+    if (!deserializeJson(doc, payload)) {
+      reportDeadband = doc["deadband"] | reportDeadband;
+      minReportInterval = doc["min_interval_ms"] | minReportInterval;
+      maxReportInterval = doc["max_interval_ms"] | maxReportInterval;
+      reportOnBandChange = doc["report_on_band_change"] | reportOnBandChange;
+      bandThresholds[0] = doc["band_thresholds"][0] | bandThresholds[0];
+      bandThresholds[1] = doc["band_thresholds"][1] | bandThresholds[1];
+      policyVersion = doc["version"] | policyVersion;
+      Serial.printf("Reporting policy v%d: deadband %d, interval %lu-%lu ms\n",
+                    policyVersion, reportDeadband, minReportInterval, maxReportInterval);
     }
   }
   http.end();
@@ -410,7 +506,7 @@ void sendSensorData(int potValue, int dangerLevel, bool emergency) {
   http.addHeader("Content-Type", "application/json");
 
   // Create JSON payload with all relevant data
-  DynamicJsonDocument doc(256);
+  DynamicJsonDocument doc(384);
   doc["analog_input"] = potValue;
   doc["danger_level"] = dangerLevel;
   doc["emergency"] = emergency;
@@ -419,6 +515,18 @@ void sendSensorData(int potValue, int dangerLevel, bool emergency) {
   doc["buzzer"] = digitalRead(BUZZER_PIN);
   doc["emergency_led"] = digitalRead(EMERGENCY_LED_PIN);
   doc["servo_open"] = servoState;
+  doc["emergency_trace"] = emergencyTrace;
+  doc["servo_trace"] = servoTrace;
+
+  // Device-side timing: the server maps device_ms onto its own clock using
+  // the round trip of the previous reading (ack_seq/ack_ms)
+  unsigned long seq = ++sendSeq;
+  doc["seq"] = seq;
+  if (ackSeq > 0) {
+    doc["ack_seq"] = ackSeq;
+    doc["ack_ms"] = ackMs;
+  }
+  doc["device_ms"] = millis();
 
   String jsonPayload;
   serializeJson(doc, jsonPayload);
@@ -432,6 +540,8 @@ void sendSensorData(int potValue, int dangerLevel, bool emergency) {
   // Process response
   if (httpCode > 0) {
     if (httpCode == HTTP_CODE_OK) {
+      ackSeq = seq;
+      ackMs = millis();
       String response = http.getString();
       Serial.println("Server response: " + response);
     }
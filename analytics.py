@@ -0,0 +1,291 @@
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+# Danger thresholds used by the dashboard
+MEDIUM_DANGER = 40
+HIGH_DANGER = 70
+
+# A reading is assumed to hold until the next one, but never longer than this.
+# Devices report by exception, so the backend's reporting policy caps its
+# heartbeat (max_interval_ms) at this gap.
+MAX_SAMPLE_GAP = 45.0
+
+# Shift name and start hour (local time); each shift runs until the next one starts
+SHIFTS = [("night", 22), ("day", 6), ("evening", 14)]
+
+# Cached results are invalidated by new readings, but are still served for
+# CACHE_TTL seconds so constant ingest does not defeat the cache. Without new
+# readings they expire after CACHE_MAX_AGE because the window keeps sliding.
+CACHE_TTL = 5.0
+CACHE_MAX_AGE = 60.0
+# Distinct (window, metric) results kept; the least recently used is dropped
+CACHE_MAX_ENTRIES = 64
+
+WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# On-disk layout of one reading in the column file; device indexes the list of
+# device IDs kept next to it
+RECORD_DTYPE = np.dtype([("time", "<f8"), ("danger", "<i2"), ("emergency", "?"),
+                         ("servo_open", "?"), ("device", "<u2")])
+
+
+class HistoryColumns:
+    """Append-only columnar copy of the reading history for NumPy queries."""
+
+    def __init__(self, capacity=4096):
+        self.size = 0
+        self.version = 0
+        self.sorted = True
+        self.lock = threading.Lock()
+        self.time = np.empty(capacity, dtype=np.float64)
+        self.danger = np.empty(capacity, dtype=np.int16)
+        self.emergency = np.empty(capacity, dtype=bool)
+        self.servo_open = np.empty(capacity, dtype=bool)
+
+    def append(self, t, danger, emergency, servo_open):
+        with self.lock:
+            if self.size == len(self.time):
+                self.grow()
+            i = self.size
+            if i and t < self.time[i - 1]:
+                self.sorted = False
+            self.time[i] = t
+            self.danger[i] = danger
+            self.emergency[i] = emergency
+            self.servo_open[i] = servo_open
+            self.size += 1
+            self.version += 1
+
+    def extend(self, t, danger, emergency, servo_open):
+        # Bulk append of whole columns, e.g. when loading from disk
+        with self.lock:
+            size = self.size + len(t)
+            while size > len(self.time):
+                self.grow()
+            if len(t) and (np.any(np.diff(t) < 0) or (self.size and t[0] < self.time[self.size - 1])):
+                self.sorted = False
+            self.time[self.size:size] = t
+            self.danger[self.size:size] = danger
+            self.emergency[self.size:size] = emergency
+            self.servo_open[self.size:size] = servo_open
+            self.size = size
+            self.version += 1
+
+    def grow(self):
+        capacity = len(self.time) * 2
+        for name in ("time", "danger", "emergency", "servo_open"):
+            column = getattr(self, name)
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+
+    def window(self, start):
+        # Columns for readings at or after start; slices are views, so later
+        # appends (which only write past the current size) do not disturb them.
+        # Late readings are sorted into new arrays for the same reason.
+        with self.lock:
+            if not self.sorted:
+                order = np.argsort(self.time[:self.size], kind="stable")
+                for name in ("time", "danger", "emergency", "servo_open"):
+                    column = getattr(self, name)
+                    ordered = np.empty(len(column), dtype=column.dtype)
+                    ordered[:self.size] = column[:self.size][order]
+                    setattr(self, name, ordered)
+                self.sorted = True
+            size = self.size
+            first = np.searchsorted(self.time[:size], start)
+            return (self.time[first:size], self.danger[first:size],
+                    self.emergency[first:size], self.servo_open[first:size])
+
+
+class HistoryStore:
+    """HistoryColumns per device, persisted as fixed-width binary records.
+
+    Readings from different devices are separate series: interleaving them
+    would pair one device's samples (or emergency activation and clear)
+    with another's. The column file loads with a single np.fromfile, so a
+    long history does not have to be parsed back from JSON on startup.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.devices_path = path + ".devices"
+        self.lock = threading.Lock()
+        self.device_ids = []
+        self.columns = {}
+
+    def load(self):
+        # False when there is no column file yet (it has to be rebuilt)
+        if not os.path.exists(self.path):
+            return False
+        if os.path.exists(self.devices_path):
+            with open(self.devices_path, "r", encoding="utf-8") as f:
+                self.device_ids = json.load(f)
+        # A crash mid-append leaves a partial record; cut it off so later
+        # appends stay aligned
+        count = os.path.getsize(self.path) // RECORD_DTYPE.itemsize
+        with open(self.path, "r+b") as f:
+            f.truncate(count * RECORD_DTYPE.itemsize)
+        records = np.fromfile(self.path, dtype=RECORD_DTYPE, count=count)
+        for index, device_id in enumerate(self.device_ids):
+            rows = records[records["device"] == index]
+            self.get(device_id).extend(rows["time"], rows["danger"], rows["emergency"], rows["servo_open"])
+        return True
+
+    def get(self, device_id):
+        columns = self.columns.get(device_id)
+        if columns is None:
+            columns = self.columns.setdefault(device_id, HistoryColumns())
+        return columns
+
+    def append(self, device_id, t, danger, emergency, servo_open):
+        with self.lock:
+            if device_id not in self.device_ids:
+                self.device_ids.append(device_id)
+                # Written whole and swapped in, so it is never half-written
+                with open(self.devices_path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(self.device_ids, f)
+                os.replace(self.devices_path + ".tmp", self.devices_path)
+            record = np.array([(t, danger, emergency, servo_open, self.device_ids.index(device_id))],
+                              dtype=RECORD_DTYPE)
+            with open(self.path, "ab") as f:
+                f.write(record.tobytes())
+        self.get(device_id).append(t, danger, emergency, servo_open)
+
+
+def parse_window(text):
+    # "90", "15m", "24h", "30d" -> seconds
+    text = text.strip().lower()
+    if text and text[-1] in WINDOW_UNITS:
+        seconds = float(text[:-1]) * WINDOW_UNITS[text[-1]]
+    else:
+        seconds = float(text)
+    # float() also accepts "nan" and "inf"
+    if not math.isfinite(seconds) or seconds <= 0:
+        raise ValueError(f"Invalid window: {text}")
+    return seconds
+
+
+def sample_durations(t, now):
+    # Time each reading was in effect, capped at MAX_SAMPLE_GAP
+    if not len(t):
+        return np.empty(0)
+    return np.clip(np.diff(t, append=max(now, t[-1])), 0, MAX_SAMPLE_GAP)
+
+
+def above_threshold(t, danger, emergency, servo_open, now):
+    dt = sample_durations(t, now)
+    total = dt.sum()
+    if not total:
+        return {"seconds": 0.0, "above_40": None, "above_70": None}
+    return {
+        "seconds": float(total),
+        "above_40": float(np.sum(dt, where=danger > MEDIUM_DANGER) / total * 100),
+        "above_70": float(np.sum(dt, where=danger > HIGH_DANGER) / total * 100),
+    }
+
+
+def shift_of_hour():
+    # Lookup table from hour of day to index into SHIFTS
+    table = np.empty(24, dtype=np.intp)
+    for index, (_, start) in enumerate(SHIFTS):
+        for hour in range(24):
+            table[(start + hour) % 24] = index
+            if (start + hour + 1) % 24 in [s for _, s in SHIFTS]:
+                break
+    return table
+
+
+def danger_distribution(t, danger, emergency, servo_open, now):
+    dt = sample_durations(t, now)
+    offset = time.localtime(now).tm_gmtoff
+    hour = ((t + offset) * (1 / 3600)).astype(np.intp)
+    hour %= 24
+
+    # Combined (shift, 10% danger band) index, built in place
+    key = shift_of_hour().take(hour)
+    key *= 10
+    key += np.minimum(danger // 10, 9)
+    totals = np.bincount(key, weights=dt,
+                         minlength=len(SHIFTS) * 10).reshape(len(SHIFTS), 10)
+
+    result = {}
+    for index, (name, _) in enumerate(SHIFTS):
+        shift_total = totals[index].sum()
+        # Percentage of the shift's time spent in each 10% danger band
+        bands = totals[index] / shift_total * 100 if shift_total else totals[index]
+        result[name] = {"seconds": float(shift_total), "bands": bands.tolist()}
+    return result
+
+
+def door_open_during_alarm(t, danger, emergency, servo_open, now):
+    dt = sample_durations(t, now)
+    alarm = emergency | (danger > HIGH_DANGER)
+    alarm_seconds = np.sum(dt, where=alarm)
+    open_seconds = np.sum(dt, where=alarm & servo_open)
+    return {
+        "alarm_seconds": float(alarm_seconds),
+        "door_open_seconds": float(open_seconds),
+        "door_open_percent": float(open_seconds / alarm_seconds * 100) if alarm_seconds else None,
+    }
+
+
+def emergency_clear_time(t, danger, emergency, servo_open, now):
+    if not len(t):
+        return {"episodes": 0, "mean_seconds": None, "max_seconds": None}
+    change = np.diff(emergency.astype(np.int8))
+    starts = np.flatnonzero(change == 1) + 1
+    ends = np.flatnonzero(change == -1) + 1
+    # An emergency already active at the window start has no known activation
+    if emergency[0]:
+        ends = ends[1:]
+    # An emergency still active at the end has not cleared yet
+    starts = starts[:len(ends)]
+    durations = t[ends] - t[starts]
+    return {
+        "episodes": int(len(durations)),
+        "mean_seconds": float(durations.mean()) if len(durations) else None,
+        "max_seconds": float(durations.max()) if len(durations) else None,
+    }
+
+
+METRIC_FUNCTIONS = {
+    "above_threshold": above_threshold,
+    "danger_distribution": danger_distribution,
+    "door_open_during_alarm": door_open_during_alarm,
+    "emergency_clear_time": emergency_clear_time,
+}
+
+cache = OrderedDict()
+cache_lock = threading.Lock()
+
+
+def run_query(history, metric, window_seconds, now=None):
+    now = time.time() if now is None else now
+    # Each device's HistoryColumns lives as long as the store, so id() is stable
+    key = (id(history), window_seconds, metric)
+    with cache_lock:
+        hit = cache.get(key)
+        if hit is not None:
+            cache.move_to_end(key)
+    if hit is not None:
+        version, computed_at, result = hit
+        age = now - computed_at
+        if age < CACHE_TTL or (version == history.version and age < CACHE_MAX_AGE):
+            return result
+
+    version = history.version
+    columns = history.window(now - window_seconds)
+    result = METRIC_FUNCTIONS[metric](*columns, now)
+    with cache_lock:
+        cache[key] = (version, now, result)
+        cache.move_to_end(key)
+        while len(cache) > CACHE_MAX_ENTRIES:
+            cache.popitem(last=False)
+    return result
@@ -1,6 +1,18 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from datetime import datetime
 from flask_cors import CORS
+from collections import OrderedDict
+from device_clock import DeviceClock, DUPLICATE, NEW, percentile
+from columnar import to_columnar
+import analytics
+import csv
+import gzip
+import io
+import json
+import os
+import threading
+import time
+import zlib
 
 app = Flask(__name__)
 CORS(app)
@@ -25,15 +37,316 @@ control_data = {
 
 log_entries = []
 
+# Persistent history of readings and events (one JSON object per line)
+HISTORY_FILE = "history.ndjson"
+EVENT_LOG_FILE = "events.ndjson"
+# Binary columns of the history for /analytics (see analytics.HistoryStore)
+HISTORY_COLUMNS_FILE = "history.columns"
+HISTORY_FIELDS = ["timestamp", "analog_input", "danger_level", "emergency", "red_led",
+                  "blue_led", "buzzer", "emergency_led", "servo_open", "device_id", "seq",
+                  "received", "source_time", "arrival_time"]
+EVENT_FIELDS = ["time", "event", "danger_level", "emergency"]
+
+# Readings are compared with the previous state of the same device and only
+# real transitions are logged: (message when turned on, message when turned off).
+# The outputs derived from these are not logged separately: emergency_led always
+# matches emergency, and red_led, blue_led and buzzer switch at the firmware's
+# 55/75 thresholds with no hysteresis. The log records danger as the dashboard's
+# 40/70 bands instead, so LED changes between those levels are not logged.
+TRANSITION_EVENTS = {
+    "emergency": ("EMERGENCY ACTIVATED", "Emergency cleared"),
+    "servo_open": ("Door opened", "Door closed")
+}
+# Danger bands are "Normal", "Warning" above 40 and "DANGER!" above 70, as on
+# the dashboard. Dropping back a band needs the level to fall BAND_HYSTERESIS
+# below the threshold, so a reading hovering on it does not flood the log.
+DANGER_THRESHOLDS = [40, 70]
+DANGER_BAND_NAMES = ["Normal", "Warning", "DANGER!"]
+BAND_HYSTERESIS = 3
+
+# Last reading and danger band per device_id
+device_states = {}
+
+# Clock offset, ordering and ingest lag per device_id
+device_clocks = {}
+
+# Command latency tracing. Dashboard commands carry a trace_id and the click
+# time; each hop adds a timestamp (unix seconds):
+#   click -> route (backend received) -> fetched (device polled it)
+#   -> actuated (device reported the new state in /esp/update)
+# control_data key -> trace_id of the latest command for it
+TRACE_LIMIT = 500
+traces = OrderedDict()
+trace_lock = threading.Lock()
+control_traces = {
+    "emergency_button": None,
+    "servo_open": None
+}
+# Trace field the device echoes in /esp/update, and the reading it must match
+TRACE_REPORT_FIELDS = {
+    "emergency_trace": "emergency",
+    "servo_trace": "servo_open"
+}
+
+# Report-by-exception policy served to devices by /esp/config. A device sends
+# a reading when danger_level moves by deadband or more (but no more often
+# than min_interval_ms), at once when it crosses one of band_thresholds, and
+# at least every max_interval_ms. Every change gets a new version number so
+# devices can poll cheaply with ?version= and get 304 while it is unchanged.
+# The heartbeat may not exceed the gap /analytics lets a reading hold for.
+DEFAULT_REPORT_POLICY = {
+    "deadband": 3,
+    "min_interval_ms": 500,
+    "max_interval_ms": 30000,
+    "band_thresholds": DANGER_THRESHOLDS,
+    "report_on_band_change": True
+}
+POLICY_LIMITS = {
+    "deadband": (0, 100),
+    "min_interval_ms": (0, 3600000),
+    "max_interval_ms": (100, int(analytics.MAX_SAMPLE_GAP * 1000))
+}
+policy_version = 1
+# device_id -> policy; "default" applies to devices without their own
+report_policies = {"default": dict(DEFAULT_REPORT_POLICY, version=policy_version)}
+
+# Responses at least this large are compressed when the client accepts it
+COMPRESS_MIN_SIZE = 512
+COMPRESS_LEVEL = 6
+
+# Export streaming: lines are batched into chunks of this size before compression
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+# Traffic capture for replay.py: set CAPTURE_FILE to record every request
+# as a compact JSON array per line: [unix_time, method, path, body]
+CAPTURE_FILE = os.environ.get("CAPTURE_FILE")
+
+store_lock = threading.Lock()
+
+# Columnar copy of the history for /analytics, one series per device_id
+history_store = analytics.HistoryStore(HISTORY_COLUMNS_FILE)
+capture_lock = threading.Lock()
+capture_stream = None
+
+
+def append_record(path, record):
+    line = json.dumps(record, separators=(",", ":")) + "\n"
+    with store_lock:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def danger_band(level, previous=None):
+    band = sum(level > threshold for threshold in DANGER_THRESHOLDS)
+    if previous is not None and band < previous:
+        if level > DANGER_THRESHOLDS[previous - 1] - BAND_HYSTERESIS:
+            return previous
+    return band
+
+
+def log_transitions(device_id, reading, current_time):
+    previous = device_states.get(device_id)
+    band = danger_band(reading["danger_level"], previous and previous["band"])
+    device_states[device_id] = dict(reading, band=band)
+    # The first reading from a device only sets the baseline
+    if previous is None:
+        return
+
+    for field, (on_event, off_event) in TRANSITION_EVENTS.items():
+        if reading[field] == previous[field]:
+            continue
+        add_log_entry(on_event if reading[field] else off_event, reading["emergency"], current_time)
+
+    if band != previous["band"]:
+        direction = "rose" if band > previous["band"] else "fell"
+        add_log_entry(f"Danger {direction} to {DANGER_BAND_NAMES[band]}", reading["emergency"], current_time)
+
+
+def start_trace(data, control_key, state):
+    trace_id = data.get("trace_id")
+    control_traces[control_key] = trace_id
+    if not trace_id:
+        return
+    with trace_lock:
+        traces[trace_id] = {
+            "trace_id": trace_id,
+            "command": control_key,
+            "state": state,
+            "click": data.get("t_click"),
+            "route": time.time(),
+            "fetched": None,
+            "actuated": None
+        }
+        if len(traces) > TRACE_LIMIT:
+            traces.popitem(last=False)
+
+
+def mark_fetched(control_key):
+    with trace_lock:
+        trace = traces.get(control_traces[control_key])
+        if trace and trace["fetched"] is None:
+            trace["fetched"] = time.time()
+
+
+def mark_actuated(data):
+    with trace_lock:
+        for field, reading_key in TRACE_REPORT_FIELDS.items():
+            trace = traces.get(data.get(field))
+            # Only count the report once the device shows the commanded state
+            if trace and trace["actuated"] is None and esp_data[reading_key] == trace["state"]:
+                trace["actuated"] = time.time()
+
+
+def add_log_entry(event, emergency, current_time):
+    entry = {
+        "event": event,
+        "time": current_time,
+        "danger_level": esp_data["danger_level"],
+        "emergency": emergency
+    }
+    log_entries.append(entry)
+    # Keep the in-memory window small; the full log lives in EVENT_LOG_FILE
+    if len(log_entries) > 50:
+        log_entries.pop(0)
+    append_record(EVENT_LOG_FILE, entry)
+
+
+def read_records(path, time_key, start=None, end=None):
+    # Timestamps are "%Y-%m-%d %H:%M:%S" strings, so they compare in time order
+    try:
+        f = open(path, "r", encoding="utf-8")
+    except FileNotFoundError:
+        return
+    with f:
+        for line in f:
+            # Skip a trailing line that is still being written by ingest
+            if not line.endswith("\n"):
+                break
+            # A crash mid-append leaves a torn line that the next append
+            # finishes off; drop it rather than the whole file
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            stamp = record.get(time_key, "")
+            if start and stamp < start:
+                continue
+            if end and stamp > end:
+                continue
+            yield record
+
+
+def add_history_column(record, stamp=None):
+    if stamp is None:
+        stamp = record.get("source_time")
+    if stamp is None:
+        # Records written before source_time was stored
+        stamp = datetime.strptime(record["timestamp"], "%Y-%m-%d %H:%M:%S").timestamp()
+    history_store.append(record.get("device_id", "esp32"), stamp, record["danger_level"],
+                         record["emergency"], record["servo_open"])
+
+
+def list_payload(records):
+    # ?shape=columnar sends each key once with its values as an array
+    if request.args.get("shape") == "columnar":
+        return to_columnar(records)
+    return records
+
+
+def encode_csv(records, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    writer.writeheader()
+    yield buffer.getvalue()
+    for record in records:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerow(record)
+        yield buffer.getvalue()
+
+
+def encode_ndjson(records):
+    for record in records:
+        yield json.dumps(record, separators=(",", ":")) + "\n"
+
+
+def gzip_chunks(lines):
+    # wbits=31 makes zlib write a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    batch = []
+    size = 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            data = compressor.compress("".join(batch).encode("utf-8"))
+            batch = []
+            size = 0
+            if data:
+                yield data
+    if batch:
+        data = compressor.compress("".join(batch).encode("utf-8"))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.before_request
+def capture_request():
+    global capture_stream
+    if not CAPTURE_FILE:
+        return
+    body = request.get_json(silent=True)
+    path = request.full_path if request.query_string else request.path
+    line = json.dumps([round(time.time(), 4), request.method, path, body],
+                      separators=(",", ":")) + "\n"
+    with capture_lock:
+        if capture_stream is None:
+            capture_stream = open(CAPTURE_FILE, "a", encoding="utf-8", buffering=1)
+        capture_stream.write(line)
+
+
+@app.after_request
+def compress_response(response):
+    # Streamed responses (e.g. /export) handle their own compression
+    if (response.is_streamed or response.status_code < 200 or response.status_code >= 300
+            or "Content-Encoding" in response.headers):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(["gzip", "deflate"])
+    if encoding is None or response.content_length is None or response.content_length < COMPRESS_MIN_SIZE:
+        return response
+
+    data = response.get_data()
+    if encoding == "gzip":
+        data = gzip.compress(data, COMPRESS_LEVEL)
+    else:
+        data = zlib.compress(data, COMPRESS_LEVEL)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
 @app.route("/esp/update", methods=["POST"])
 def update_esp():
     global esp_data
 
     data = request.json
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    arrival = time.time()
+    device_id = data.get("device_id", "esp32")
 
-    # Update ESP data
-    esp_data = {
+    # Readings are stored at the time the device took them, using the
+    # device's millis() mapped through the estimated clock offset
+    clock = device_clocks.setdefault(device_id, DeviceClock())
+    source_time, status = clock.observe(data, arrival)
+    # A retry of a reading that already got through is acknowledged again
+    # (the device may not have seen the first response) but not stored twice
+    if status == DUPLICATE:
+        clock.responded(data, arrival, time.time())
+        return jsonify({"message": "ESP data received", "seq": data.get("seq")})
+    current_time = datetime.fromtimestamp(source_time).strftime("%Y-%m-%d %H:%M:%S")
+
+    reading = {
         "analog_input": data.get("analog_input", 0),
         "danger_level": data.get("danger_level", 0),
         "emergency": data.get("emergency", False),
@@ -42,104 +355,249 @@ def update_esp():
         "buzzer": data.get("buzzer", False),
         "emergency_led": data.get("emergency_led", False),
         "servo_open": data.get("servo_open", False),
-        "timestamp": current_time
+        "timestamp": current_time,
+        "device_id": device_id,
+        "seq": data.get("seq"),
+        "received": datetime.fromtimestamp(arrival).strftime("%Y-%m-%d %H:%M:%S"),
+        # Unix seconds; timestamp and received are only to the second
+        "source_time": round(source_time, 3),
+        "arrival_time": round(arrival, 3)
     }
+    append_record(HISTORY_FILE, reading)
+    add_history_column(reading, source_time)
 
-    # Log emergency state changes
-    if data.get("emergency") is not None:
-        event = "EMERGENCY ACTIVATED" if data["emergency"] else "Emergency cleared"
-        log_entries.append({
-            "event": event,
-            "time": current_time,
-            "danger_level": esp_data["danger_level"],
-            "emergency": data["emergency"]
-        })
-        if len(log_entries) > 50:
-            log_entries.pop(0)
+    # A late (retried) reading goes into the history only; it is older
+    # than the current state, so it neither replaces it nor logs transitions
+    if status == NEW:
+        esp_data = reading
+        # Log only the state changes since this device's previous reading
+        log_transitions(device_id, esp_data, current_time)
+        mark_actuated(data)
 
-    return jsonify({"message": "ESP data received"})
+    clock.responded(data, arrival, time.time())
+    return jsonify({"message": "ESP data received", "seq": data.get("seq")})
 
 @app.route("/esp/emergency", methods=["POST"])
 def esp_emergency():
-    global esp_data, log_entries
-    
+    global esp_data
+
     data = request.json
     emergency_state = data.get("emergency", False)
     esp_data["emergency"] = emergency_state
-    
+    # Already logged here, so the next periodic reading is not a new transition
+    device_id = data.get("device_id", "esp32")
+    if device_id in device_states:
+        device_states[device_id]["emergency"] = emergency_state
+
     # Log the emergency event
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     event = "PHYSICAL EMERGENCY BUTTON PRESSED" if emergency_state else "Physical emergency cleared"
-    log_entries.append({
-        "event": event,
-        "time": current_time,
-        "danger_level": esp_data["danger_level"],
-        "emergency": emergency_state
-    })
-    if len(log_entries) > 50:
-        log_entries.pop(0)
-    
+    add_log_entry(event, emergency_state, current_time)
+
     return jsonify({"message": "Emergency state updated"})
 
 @app.route("/flet/emergency", methods=["POST"])
 def flet_emergency():
-    global control_data, log_entries
-    
+    global control_data
+
     data = request.json
     emergency_state = data.get("emergency", False)
     control_data["emergency_button"] = emergency_state
-    
+    start_trace(data, "emergency_button", emergency_state)
+
     # Log the emergency event
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     event = "FLET EMERGENCY BUTTON PRESSED" if emergency_state else "Flet emergency cleared"
-    log_entries.append({
-        "event": event,
-        "time": current_time,
-        "danger_level": esp_data["danger_level"],
-        "emergency": emergency_state
-    })
-    if len(log_entries) > 50:
-        log_entries.pop(0)
-    
+    add_log_entry(event, emergency_state, current_time)
+
     return jsonify({"message": "Emergency state updated"})
 
 @app.route("/esp/servo", methods=["POST"])
 def control_servo():
-    global control_data, log_entries
-    
+    global control_data
+
     data = request.json
     servo_state = data.get("servo_open", False)
     control_data["servo_open"] = servo_state
-    
+    start_trace(data, "servo_open", servo_state)
+
     # Log the servo event
     current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     event = "Servo opened" if servo_state else "Servo closed"
-    log_entries.append({
-        "event": event,
-        "time": current_time,
-        "danger_level": esp_data["danger_level"],
-        "emergency": esp_data["emergency"]
-    })
-    if len(log_entries) > 50:
-        log_entries.pop(0)
-    
+    add_log_entry(event, esp_data["emergency"], current_time)
+
     return jsonify({"message": "Servo state updated"})
 
 @app.route("/esp/servo_status", methods=["GET"])
 def get_servo_status():
-    return jsonify({"servo_open": control_data["servo_open"]})
+    mark_fetched("servo_open")
+    return jsonify({
+        "servo_open": control_data["servo_open"],
+        "trace_id": control_traces["servo_open"]
+    })
 
 @app.route("/esp/control", methods=["GET"])
 def control_esp():
-    return jsonify(control_data)
+    # The firmware applies only the emergency command from here; servo
+    # commands are applied from /esp/servo_status
+    mark_fetched("emergency_button")
+    return jsonify(dict(control_data, emergency_trace=control_traces["emergency_button"]))
 
 @app.route("/dashboard", methods=["GET"])
 def get_dashboard():
+    # ?logs=N limits how many recent log entries are included (0 for none)
+    limit = request.args.get("logs", 20, type=int)
     return jsonify({
         "esp": esp_data,
-        "logs": log_entries[-20:]  # Show last 20 entries
+        "logs": list_payload(log_entries[-limit:] if limit > 0 else [])
+    })
+
+@app.route("/logs", methods=["GET"])
+def get_logs():
+    limit = request.args.get("limit", 20, type=int)
+    # The current danger level and emergency state let a client that only
+    # watches the log still poll faster while danger rises or an emergency is on
+    return jsonify({
+        "logs": list_payload(log_entries[-limit:] if limit > 0 else []),
+        "danger_level": esp_data.get("danger_level", 0),
+        "emergency": esp_data.get("emergency", False)
+    })
+
+# Stream the full history or event log for a time range
+# e.g. /export?kind=events&format=csv&start=2025-01-01 00:00:00&end=2025-02-01 00:00:00
+@app.route("/export", methods=["GET"])
+def export_data():
+    kind = request.args.get("kind", "history")
+    fmt = request.args.get("format", "ndjson")
+    start = request.args.get("start")
+    end = request.args.get("end")
+    compress = request.args.get("compress", "1") != "0"
+
+    if kind == "history":
+        records = read_records(HISTORY_FILE, "timestamp", start, end)
+        fields = HISTORY_FIELDS
+    elif kind == "events":
+        records = read_records(EVENT_LOG_FILE, "time", start, end)
+        fields = EVENT_FIELDS
+    else:
+        return jsonify({"error": f"Unknown kind: {kind}"}), 400
+
+    if fmt == "csv":
+        lines = encode_csv(records, fields)
+        mimetype = "text/csv"
+    elif fmt == "ndjson":
+        lines = encode_ndjson(records)
+        mimetype = "application/x-ndjson"
+    else:
+        return jsonify({"error": f"Unknown format: {fmt}"}), 400
+
+    filename = f"{kind}.{fmt}"
+    if compress:
+        body = gzip_chunks(lines)
+        mimetype = "application/gzip"
+        filename += ".gz"
+    else:
+        body = lines
+
+    return Response(body, mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+# Reporting policy for a device; ?version=N returns 304 while it is unchanged
+@app.route("/esp/config", methods=["GET"])
+def get_device_config():
+    device_id = request.args.get("device_id", "esp32")
+    policy = report_policies.get(device_id, report_policies["default"])
+    etag = f'"{policy["version"]}"'
+    if (request.args.get("version", type=int) == policy["version"]
+            or request.headers.get("If-None-Match") == etag):
+        return Response(status=304, headers={"ETag": etag})
+    response = jsonify(policy)
+    response.headers["ETag"] = etag
+    return response
+
+# Change the reporting policy for one device (or "default" for all others)
+@app.route("/esp/config", methods=["POST"])
+def update_device_config():
+    global policy_version
+
+    data = request.json
+    device_id = data.get("device_id", "default")
+    policy = dict(report_policies.get(device_id, report_policies["default"]))
+
+    for field, (low, high) in POLICY_LIMITS.items():
+        if field in data:
+            value = data[field]
+            if not isinstance(value, int) or isinstance(value, bool) or not low <= value <= high:
+                return jsonify({"error": f"{field} must be an integer in [{low}, {high}]"}), 400
+            policy[field] = value
+    if "report_on_band_change" in data:
+        if not isinstance(data["report_on_band_change"], bool):
+            return jsonify({"error": "report_on_band_change must be true or false"}), 400
+        policy["report_on_band_change"] = data["report_on_band_change"]
+    if policy["min_interval_ms"] > policy["max_interval_ms"]:
+        return jsonify({"error": "min_interval_ms must not exceed max_interval_ms"}), 400
+
+    policy_version += 1
+    policy["version"] = policy_version
+    report_policies[device_id] = policy
+    return jsonify(policy)
+
+# Per-device clock offset, ingest lag and out-of-order arrivals
+@app.route("/devices", methods=["GET"])
+def get_devices():
+    return jsonify({device_id: clock.metrics() for device_id, clock in device_clocks.items()})
+
+# Click-to-actuation latency report for traced dashboard commands
+@app.route("/traces", methods=["GET"])
+def get_traces():
+    with trace_lock:
+        recorded = [dict(t) for t in traces.values()]
+    completed = [t for t in recorded if t["click"] is not None and t["actuated"] is not None]
+    hops = {
+        "click_to_route": [t["route"] - t["click"] for t in completed],
+        "route_to_fetch": [t["fetched"] - t["route"] for t in completed if t["fetched"] is not None],
+        "fetch_to_actuation": [t["actuated"] - t["fetched"] for t in completed if t["fetched"] is not None],
+        "click_to_actuation": [t["actuated"] - t["click"] for t in completed]
+    }
+    limit = request.args.get("limit", 20, type=int)
+    return jsonify({
+        "traced": len(recorded),
+        "completed": len(completed),
+        "latency": {
+            name: {"p50": percentile(values, 0.5), "p99": percentile(values, 0.99)}
+            for name, values in hops.items()
+        },
+        "recent": list_payload(recorded[-limit:] if limit > 0 else [])
     })
 
+# Time-weighted safety statistics over the recent history of one device
+# e.g. /analytics?metric=above_threshold&window=30d&device_id=esp32
+@app.route("/analytics", methods=["GET"])
+def get_analytics():
+    metric = request.args.get("metric", "above_threshold")
+    if metric not in analytics.METRIC_FUNCTIONS:
+        return jsonify({"error": f"Unknown metric: {metric}"}), 400
+    try:
+        window = analytics.parse_window(request.args.get("window", "24h"))
+    except ValueError:
+        return jsonify({"error": "Invalid window"}), 400
+
+    device_id = request.args.get("device_id", "esp32")
+
+    started = time.perf_counter()
+    result = analytics.run_query(history_store.get(device_id), metric, window)
+    return jsonify({
+        "device_id": device_id,
+        "metric": metric,
+        "window_seconds": window,
+        "result": result,
+        "query_ms": round((time.perf_counter() - started) * 1000, 2)
+    })
+
+# Rebuild the column file from the JSON history the first time (or if it was removed)
+if not history_store.load():
+    for record in read_records(HISTORY_FILE, "timestamp"):
+        add_history_column(record)
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
-    
\ No newline at end of file
@@ -0,0 +1,90 @@
+import gzip
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+import zlib
+
+from columnar import from_columnar
+
+ENDPOINTS = [
+    ("/dashboard", {"logs": 20}, "logs"),
+    ("/logs", {"limit": 50}, "logs"),
+    ("/traces", {"limit": 200}, "recent"),
+]
+VARIANTS = [
+    ("rows", "identity"),
+    ("rows", "gzip"),
+    ("columnar", "identity"),
+    ("columnar", "gzip"),
+    ("columnar", "deflate"),
+]
+ITERATIONS = 200
+
+
+def seed(client):
+    # Enough traffic to fill the log window and the trace table
+    for i in range(200):
+        client.post("/esp/servo", json={
+            "servo_open": i % 2 == 0,
+            "trace_id": uuid.uuid4().hex[:12],
+            "t_click": time.time()
+        })
+        client.post("/esp/update", json={
+            "analog_input": random.randint(0, 4095),
+            "danger_level": random.randint(0, 100),
+            "servo_open": i % 2 == 0
+        })
+
+
+def decode(body, encoding, shape, list_key):
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    elif encoding == "deflate":
+        body = zlib.decompress(body)
+    payload = json.loads(body)
+    if shape == "columnar":
+        payload[list_key] = from_columnar(payload[list_key])
+    return payload
+
+
+def main():
+    # Run against a throwaway data directory so the benchmark leaves no history
+    # behind; backend loads and appends its files relative to the working dir
+    with tempfile.TemporaryDirectory() as data_dir:
+        cwd = os.getcwd()
+        os.chdir(data_dir)
+        try:
+            import backend
+            run(backend.app.test_client())
+        finally:
+            os.chdir(cwd)
+
+
+def run(client):
+    seed(client)
+
+    print(f"{'endpoint':12s} {'shape':9s} {'encoding':9s} {'bytes':>8s} {'vs rows':>8s} {'decode us':>10s}")
+    for path, params, list_key in ENDPOINTS:
+        baseline = None
+        for shape, encoding in VARIANTS:
+            query = dict(params, shape=shape) if shape == "columnar" else params
+            response = client.get(path, query_string=query, headers={"Accept-Encoding": encoding})
+            body = response.get_data()
+            sent = response.headers.get("Content-Encoding", "identity")
+            if baseline is None:
+                baseline = len(body)
+
+            started = time.perf_counter()
+            for _ in range(ITERATIONS):
+                decode(body, sent, shape, list_key)
+            decode_us = (time.perf_counter() - started) / ITERATIONS * 1e6
+
+            print(f"{path:12s} {shape:9s} {sent:9s} {len(body):8d} "
+                  f"{len(body) / baseline * 100:7.1f}% {decode_us:10.1f}")
+
+
+if __name__ == "__main__":
+    main()
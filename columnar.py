@@ -0,0 +1,20 @@
+# Columnar JSON shape for list responses: each key is sent once with its
+# values as an array, instead of repeating every key on every record.
+#   [{"time": "a", "event": "x"}, {"time": "b", "event": "y"}]
+#   -> {"time": ["a", "b"], "event": ["x", "y"]}
+
+
+def to_columnar(records):
+    keys = []
+    for record in records:
+        for key in record:
+            if key not in keys:
+                keys.append(key)
+    return {key: [record.get(key) for record in records] for key in keys}
+
+
+def from_columnar(columns):
+    if not columns:
+        return []
+    keys = list(columns)
+    return [dict(zip(keys, values)) for values in zip(*columns.values())]
@@ -0,0 +1,149 @@
+import threading
+from collections import deque
+
+# Round-trip samples kept per device; the offset comes from the one with the
+# smallest round-trip delay, as in NTP's clock filter
+CLOCK_SAMPLES = 8
+
+# A device_ms this far below the last one means the device rebooted, as does
+# a lower seq with no ack (a freshly booted device has not been answered yet)
+REBOOT_GAP_MS = 60000
+
+# Recent ingest lags kept per device for percentiles
+LAG_WINDOW = 500
+
+# Recent seqs remembered per device, so a retried reading is recognised as a
+# duplicate rather than a late one
+SEEN_WINDOW = 64
+
+# observe() outcomes
+NEW = "new"
+LATE = "late"
+DUPLICATE = "duplicate"
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class DeviceClock:
+    """Maps a device's millis() onto server time and tracks ingest lag.
+
+    Every reading carries seq and device_ms (t0). The server remembers when
+    it received it (t1) and answered (t2). The next reading acknowledges
+    that seq with the device time the response arrived (t3), which gives an
+    NTP-style sample: offset = ((t1 - t0) + (t2 - t3)) / 2.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = deque(maxlen=CLOCK_SAMPLES)
+        self.pending = {}
+        self.offset = None
+        self.delay = None
+        self.last_seq = None
+        self.last_device_ms = None
+        self.received = 0
+        self.out_of_order = 0
+        self.duplicates = 0
+        self.reboots = 0
+        self.lags = deque(maxlen=LAG_WINDOW)
+        self.seen = deque(maxlen=SEEN_WINDOW)
+
+    def reset(self):
+        self.samples.clear()
+        self.pending.clear()
+        self.offset = None
+        self.delay = None
+        self.last_seq = None
+        self.last_device_ms = None
+        self.seen.clear()
+
+    def add_sample(self, ack_seq, ack_ms):
+        sent = self.pending.pop(ack_seq, None)
+        if sent is None:
+            return
+        t0_ms, t1, t2 = sent
+        t0 = t0_ms / 1000
+        t3 = ack_ms / 1000
+        delay = (t3 - t0) - (t2 - t1)
+        if delay < 0:
+            return
+        self.samples.append((delay, ((t1 - t0) + (t2 - t3)) / 2))
+        self.delay, self.offset = min(self.samples)
+
+    def observe(self, data, arrival):
+        """Record a reading; returns (source_time, status).
+
+        status is NEW for the latest reading, LATE for an older one arriving
+        after it and DUPLICATE for a seq that was already received (a retry
+        whose first attempt got through).
+        """
+        seq = data.get("seq")
+        device_ms = data.get("device_ms")
+        with self.lock:
+            self.received += 1
+            if seq is None or device_ms is None:
+                # Older firmware: only the arrival time is known
+                return arrival, NEW
+
+            if self.last_seq is not None and (
+                    device_ms < self.last_device_ms - REBOOT_GAP_MS
+                    or (data.get("ack_seq") is None and seq < self.last_seq)):
+                self.reboots += 1
+                self.reset()
+
+            if data.get("ack_seq") is not None and data.get("ack_ms") is not None:
+                self.add_sample(data["ack_seq"], data["ack_ms"])
+
+            if seq in self.seen:
+                self.duplicates += 1
+                status = DUPLICATE
+            elif self.last_seq is None or seq > self.last_seq:
+                self.last_seq = seq
+                self.last_device_ms = device_ms
+                status = NEW
+            else:
+                self.out_of_order += 1
+                status = LATE
+            if status != DUPLICATE:
+                self.seen.append(seq)
+
+            # Until the first round trip completes, fall back to arrival time
+            if self.offset is None:
+                return arrival, status
+            source_time = device_ms / 1000 + self.offset
+            if status != DUPLICATE:
+                self.lags.append(arrival - source_time)
+            return source_time, status
+
+    def responded(self, data, arrival, responded_at):
+        # Remember t0/t1/t2 until the device acknowledges this seq
+        if data.get("seq") is None or data.get("device_ms") is None:
+            return
+        with self.lock:
+            self.pending[data["seq"]] = (data["device_ms"], arrival, responded_at)
+            # Unacknowledged entries (lost responses) must not pile up
+            while len(self.pending) > CLOCK_SAMPLES * 4:
+                self.pending.pop(next(iter(self.pending)))
+
+    def metrics(self):
+        with self.lock:
+            lags = list(self.lags)
+            return {
+                "received": self.received,
+                "out_of_order": self.out_of_order,
+                "duplicates": self.duplicates,
+                "reboots": self.reboots,
+                "last_seq": self.last_seq,
+                "clock_offset": self.offset,
+                "round_trip": self.delay,
+                "ingest_lag": {
+                    "p50": percentile(lags, 0.5),
+                    "p99": percentile(lags, 0.99),
+                    "max": max(lags) if lags else None
+                }
+            }
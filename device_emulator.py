@@ -0,0 +1,331 @@
+import argparse
+import random
+import threading
+import time
+import uuid
+
+import requests
+
+SERVER_URL = "http://127.0.0.1:5000"
+
+# Same timing as the firmware (seconds)
+SEND_INTERVAL = 2.0
+EMERGENCY_CHECK_INTERVAL = 1.0
+SERVO_CHECK_INTERVAL = 1.0
+CONFIG_CHECK_INTERVAL = 60.0
+# One pass of the firmware loop: 5 x 10 ms potentiometer samples + 10 ms delay
+LOOP_PERIOD = 0.06
+
+# Same thresholds as the firmware
+MEDIUM_DANGER_THRESHOLD = 55
+HIGH_DANGER_THRESHOLD = 75
+
+
+class ReportPolicy:
+    """Report-by-exception rule, mirroring shouldReport() in the firmware.
+
+    Until a policy is loaded it reports every SEND_INTERVAL, like the
+    firmware before its first /esp/config fetch.
+    """
+
+    def __init__(self, policy=None):
+        self.version = 0
+        self.deadband = 0
+        self.min_interval = SEND_INTERVAL
+        self.max_interval = SEND_INTERVAL
+        self.report_on_band_change = False
+        self.band_thresholds = [40, 70]
+        self.last_sent = None
+        if policy:
+            self.load(policy)
+
+    def load(self, policy):
+        self.version = policy["version"]
+        self.deadband = policy["deadband"]
+        self.min_interval = policy["min_interval_ms"] / 1000
+        self.max_interval = policy["max_interval_ms"] / 1000
+        self.report_on_band_change = policy["report_on_band_change"]
+        self.band_thresholds = policy["band_thresholds"]
+
+    def band(self, danger_level):
+        return sum(danger_level > threshold for threshold in self.band_thresholds)
+
+    def due(self, now, danger_level, emergency, servo_open):
+        if self.last_sent is None:
+            return True
+        sent_at, sent_danger, sent_emergency, sent_servo = self.last_sent
+        elapsed = now - sent_at
+        if elapsed >= self.max_interval:
+            return True
+        if self.report_on_band_change and self.band(danger_level) != self.band(sent_danger):
+            return True
+        if elapsed < self.min_interval:
+            return False
+        if emergency != sent_emergency or servo_open != sent_servo:
+            return True
+        return self.deadband > 0 and abs(danger_level - sent_danger) >= self.deadband
+
+    def sent(self, now, danger_level, emergency, servo_open):
+        self.last_sent = (now, danger_level, emergency, servo_open)
+
+
+class Potentiometer:
+    """A knob that mostly sits still and is occasionally turned.
+
+    Readings carry a little ADC noise, as the firmware's 5-sample average does.
+    """
+
+    def __init__(self, rng, turn_probability=0.002):
+        self.rng = rng
+        self.turn_probability = turn_probability
+        self.value = rng.uniform(0, 4095)
+        self.target = self.value
+
+    def read(self):
+        if self.rng.random() < self.turn_probability:
+            self.target = self.rng.uniform(0, 4095)
+        # Turning the knob takes a second or two
+        self.value += max(-150.0, min(150.0, self.target - self.value))
+        noisy = self.value + self.rng.gauss(0, 6)
+        return int(min(4095, max(0, noisy)))
+
+
+def danger_from_pot(pot_value):
+    return pot_value * 100 // 4095
+
+
+class EmulatedDevice:
+    """Python stand-in for the ESP32 firmware loop in ESP32_P4.ino.ino.
+
+    Polls /esp/control and /esp/servo_status, applies commands, echoes their
+    trace IDs and reports straight after actuating, like the firmware does.
+    """
+
+    def __init__(self, server, device_id="esp32", seed=None):
+        self.server = server
+        self.device_id = device_id
+        self.session = requests.Session()
+        self.potentiometer = Potentiometer(random.Random(seed))
+        self.policy = ReportPolicy()
+        self.reports = 0
+        self.emergency = False
+        self.servo_open = False
+        self.emergency_trace = ""
+        self.servo_trace = ""
+        self.report_now = False
+        self.boot_time = time.monotonic()
+        self.seq = 0
+        self.ack_seq = None
+        self.ack_ms = None
+
+    def millis(self):
+        return int((time.monotonic() - self.boot_time) * 1000)
+
+    def check_report_policy(self):
+        response = self.session.get(f"{self.server}/esp/config", timeout=5, params={
+            "device_id": self.device_id,
+            "version": self.policy.version
+        })
+        # 304: the policy we have is still current
+        if response.status_code == 200:
+            self.policy.load(response.json())
+
+    def check_emergency_status(self):
+        control = self.session.get(f"{self.server}/esp/control", timeout=5).json()
+        if control["emergency_button"] != self.emergency:
+            self.emergency = control["emergency_button"]
+            if self.emergency:
+                self.servo_open = False
+            self.emergency_trace = control.get("emergency_trace") or ""
+            self.report_now = True
+
+    def check_servo_status(self):
+        status = self.session.get(f"{self.server}/esp/servo_status", timeout=5).json()
+        if status["servo_open"] != self.servo_open and not self.emergency:
+            self.servo_open = status["servo_open"]
+            self.servo_trace = status.get("trace_id") or ""
+            self.report_now = True
+
+    def send_sensor_data(self, pot_value):
+        danger_level = danger_from_pot(pot_value)
+        high = danger_level > HIGH_DANGER_THRESHOLD
+        self.seq += 1
+        seq = self.seq
+        response = self.session.post(f"{self.server}/esp/update", timeout=5, json={
+            "device_id": self.device_id,
+            "seq": seq,
+            "device_ms": self.millis(),
+            "ack_seq": self.ack_seq,
+            "ack_ms": self.ack_ms,
+            "analog_input": pot_value,
+            "danger_level": danger_level,
+            "emergency": self.emergency,
+            "red_led": self.emergency or high,
+            "blue_led": not self.emergency and not high and danger_level > MEDIUM_DANGER_THRESHOLD,
+            "buzzer": self.emergency or high,
+            "emergency_led": self.emergency,
+            "servo_open": self.servo_open,
+            "emergency_trace": self.emergency_trace,
+            "servo_trace": self.servo_trace
+        })
+        self.reports += 1
+        # Acknowledged in the next reading for the backend's offset estimate
+        if response.status_code == 200:
+            self.ack_seq = seq
+            self.ack_ms = self.millis()
+
+    def run(self, stop):
+        last_emergency_check = last_servo_check = last_config_check = float("-inf")
+        while not stop.is_set():
+            now = time.monotonic()
+            pot_value = self.potentiometer.read()
+            danger_level = danger_from_pot(pot_value)
+            try:
+                if now - last_emergency_check >= EMERGENCY_CHECK_INTERVAL:
+                    self.check_emergency_status()
+                    last_emergency_check = now
+                if now - last_servo_check >= SERVO_CHECK_INTERVAL:
+                    self.check_servo_status()
+                    last_servo_check = now
+                config_interval = SEND_INTERVAL if self.policy.version == 0 else CONFIG_CHECK_INTERVAL
+                if now - last_config_check >= config_interval:
+                    self.check_report_policy()
+                    last_config_check = now
+                if self.report_now or self.policy.due(now, danger_level, self.emergency, self.servo_open):
+                    self.send_sensor_data(pot_value)
+                    self.policy.sent(now, danger_level, self.emergency, self.servo_open)
+                    self.report_now = False
+            except requests.RequestException as ex:
+                print(f"{self.device_id}: {ex}")
+            time.sleep(LOOP_PERIOD)
+
+
+def click_servo(server, clicks, spacing, stop):
+    # Toggle the door like the dashboard's servo_button, with trace fields
+    servo_open = False
+    for _ in range(clicks):
+        if stop.wait(spacing):
+            return
+        servo_open = not servo_open
+        requests.post(f"{server}/esp/servo", timeout=5, json={
+            "servo_open": servo_open,
+            "trace_id": uuid.uuid4().hex[:12],
+            "t_click": time.time()
+        })
+
+
+def print_trace_report(server):
+    report = requests.get(f"{server}/traces", params={"limit": 0}, timeout=5).json()
+    print(f"Traced commands: {report['traced']}, completed: {report['completed']}")
+    for hop, stats in report["latency"].items():
+        if stats["p50"] is None:
+            print(f"  {hop:20s} no data")
+        else:
+            print(f"  {hop:20s} p50 {stats['p50'] * 1000:8.1f} ms   p99 {stats['p99'] * 1000:8.1f} ms")
+
+
+def simulate_policy(policy, devices, hours, seed=0):
+    """Replays the same knob movements under the fixed SEND_INTERVAL and under
+    a report-by-exception policy, offline.
+
+    The stored history holds each reported value until the next report, so
+    the error is how far that held value is from the true danger level.
+    """
+    ticks = int(hours * 3600 / LOOP_PERIOD)
+    baseline_reports = policy_reports = 0
+    max_error = within = 0
+    for device in range(devices):
+        potentiometer = Potentiometer(random.Random(seed + device))
+        rule = ReportPolicy(policy)
+        next_baseline = 0.0
+        stored = None
+        for tick in range(ticks):
+            now = tick * LOOP_PERIOD
+            danger_level = danger_from_pot(potentiometer.read())
+            if now >= next_baseline:
+                baseline_reports += 1
+                next_baseline += SEND_INTERVAL
+            if rule.due(now, danger_level, False, False):
+                rule.sent(now, danger_level, False, False)
+                policy_reports += 1
+                stored = danger_level
+            error = abs(danger_level - stored)
+            max_error = max(max_error, error)
+            within += error < max(policy["deadband"], 1)
+    total = ticks * devices
+    return {
+        "baseline_reports": baseline_reports,
+        "policy_reports": policy_reports,
+        "reduction": 1 - policy_reports / baseline_reports,
+        "max_error": max_error,
+        "within_deadband": within / total
+    }
+
+
+def print_policy_report(policy, result, devices, hours):
+    print(f"Policy: deadband {policy['deadband']}, interval {policy['min_interval_ms']}-"
+          f"{policy['max_interval_ms']} ms, band change {policy['report_on_band_change']}")
+    print(f"{devices} device(s) over {hours:g} h")
+    print(f"  reports every {SEND_INTERVAL:g} s  {result['baseline_reports']:10d}")
+    print(f"  reports by exception  {result['policy_reports']:10d}   "
+          f"({result['reduction'] * 100:.1f}% fewer)")
+    print(f"  stored history within deadband {result['within_deadband'] * 100:.2f}% of the time, "
+          f"max error {result['max_error']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Emulate the ESP32 against a local backend")
+    parser.add_argument("--server", default=SERVER_URL)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds to run")
+    parser.add_argument("--fleet", type=int, default=1, help="number of devices to emulate")
+    parser.add_argument("--clicks", type=int, default=0,
+                        help="simulate this many traced servo clicks, then print a latency report")
+    parser.add_argument("--click-spacing", type=float, default=2.5)
+    parser.add_argument("--simulate-policy", action="store_true",
+                        help="estimate ingest saved by a report policy offline, without a server")
+    parser.add_argument("--hours", type=float, default=24.0, help="simulated time per device")
+    parser.add_argument("--deadband", type=int, default=3)
+    parser.add_argument("--min-interval", type=int, default=500, help="milliseconds")
+    parser.add_argument("--max-interval", type=int, default=30000, help="milliseconds")
+    args = parser.parse_args()
+
+    if args.simulate_policy:
+        policy = {
+            "version": 1,
+            "deadband": args.deadband,
+            "min_interval_ms": args.min_interval,
+            "max_interval_ms": args.max_interval,
+            "band_thresholds": [40, 70],
+            "report_on_band_change": True
+        }
+        result = simulate_policy(policy, args.fleet, args.hours)
+        print_policy_report(policy, result, args.fleet, args.hours)
+        return
+
+    stop = threading.Event()
+    fleet = [EmulatedDevice(args.server) if args.fleet == 1 else
+             EmulatedDevice(args.server, f"esp32-{n}", seed=n)
+             for n in range(1, args.fleet + 1)]
+    for device in fleet:
+        threading.Thread(target=device.run, args=(stop,), daemon=True).start()
+    if args.clicks:
+        threading.Thread(target=click_servo,
+                         args=(args.server, args.clicks, args.click_spacing, stop),
+                         daemon=True).start()
+
+    try:
+        stop.wait(args.duration)
+        if args.clicks:
+            # Keep the device running until the last command has been applied
+            time.sleep(SERVO_CHECK_INTERVAL + 0.5)
+    except KeyboardInterrupt:
+        pass
+    stop.set()
+
+    print(f"Readings sent: {sum(device.reports for device in fleet)} from {len(fleet)} device(s)")
+    if args.clicks:
+        print_trace_report(args.server)
+
+
+if __name__ == "__main__":
+    main()
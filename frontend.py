@@ -2,10 +2,398 @@ import flet as ft
 import requests
 import time
 import threading
+import uuid
 from datetime import datetime
+from columnar import from_columnar
 
 SERVER_URL = "http://192.168.8.130:5000"
 
+# HTTP sessions reuse connections and ask for compressed responses (requests
+# decompresses gzip/deflate bodies transparently). requests.Session is not
+# thread-safe, so the poller and each command worker get their own.
+http_local = threading.local()
+
+# Seconds before a backend request is abandoned
+REQUEST_TIMEOUT = 5
+
+
+def http_session():
+    session = getattr(http_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers["Accept-Encoding"] = "gzip, deflate"
+        http_local.session = session
+    return session
+
+
+# Upper bound on page updates pushed to the client per second
+MAX_FPS = 20
+
+# Polling intervals in seconds
+FAST_INTERVAL = 0.2       # Emergency active or danger rising
+NORMAL_INTERVAL = 0.5
+IDLE_MAX_INTERVAL = 5.0   # Back-off ceiling while nothing changes
+HIDDEN_INTERVAL = 15.0    # Window hidden or app in background
+IDLE_AFTER_POLLS = 10     # Unchanged polls before backing off
+RISING_HOLD = 5.0         # Seconds to stay fast after danger last rose
+
+# Dashboard commands: backend route and the JSON field carrying the state
+COMMANDS = {
+    "emergency": ("/flet/emergency", "emergency"),
+    "servo": ("/esp/servo", "servo_open"),
+}
+# After the backend accepts a command, keep showing it for this long while
+# the device catches up, instead of flipping back to the stale reading
+COMMAND_HOLD = 3.0
+
+
+class ViewModel:
+    """Remembers what was last rendered and pushes only changed controls.
+
+    Property writes go through set(), which skips values that have not
+    moved since the last render. flush() sends every touched control in a
+    single page.update(), at most once per frame.
+    """
+
+    def __init__(self, page, max_fps=MAX_FPS):
+        self.page = page
+        self.frame_interval = 1.0 / max_fps
+        self.rendered = {}
+        self.dirty = {}
+        self.lock = threading.Lock()
+        self.last_flush = 0.0
+        self.timer = None
+
+    def changed(self, control, prop, value, apply):
+        # Record value for control/prop and call apply() if it differs from the
+        # last render. apply() runs under the lock before the control is marked
+        # dirty, so a deferred flush can never send it half-updated.
+        key = (id(control), prop)
+        with self.lock:
+            if key in self.rendered and self.rendered[key] == value:
+                return False
+            apply()
+            self.rendered[key] = value
+            self.dirty[id(control)] = control
+        return True
+
+    def set(self, control, prop, value):
+        # prop may be dotted, e.g. "style.bgcolor"
+        *parents, name = prop.split(".")
+        target = control
+        for parent in parents:
+            target = getattr(target, parent)
+        self.changed(control, prop, value, lambda: setattr(target, name, value))
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            wait = self.last_flush + self.frame_interval - time.monotonic()
+            if wait > 0:
+                # Too soon after the last frame: coalesce into a deferred flush
+                if self.timer is None:
+                    self.timer = threading.Timer(wait, self.flush_now)
+                    self.timer.daemon = True
+                    self.timer.start()
+                return
+        self.flush_now()
+
+    def flush_now(self):
+        with self.lock:
+            self.timer = None
+            controls = list(self.dirty.values())
+            self.dirty.clear()
+            self.last_flush = time.monotonic()
+        if controls:
+            self.page.update(*controls)
+
+
+class RefreshScheduler:
+    """Picks the next polling interval from the latest data and visibility.
+
+    Polls quickly while an emergency is active or danger is rising, at the
+    normal rate while readings move, and backs off exponentially once they
+    stop changing. A hidden window polls at HIDDEN_INTERVAL. wake() cuts
+    the current wait short, e.g. when the user switches tabs.
+    """
+
+    def __init__(self):
+        self.visible = True
+        self.interval = NORMAL_INTERVAL
+        self.unchanged_polls = 0
+        self.last_level = None
+        self.last_snapshot = None
+        self.fast_until = 0.0
+        self.wake_event = threading.Event()
+
+    def observe(self, snapshot, level=None, emergency=False):
+        # snapshot is whatever the poll fetched, minus volatile fields
+        changed = snapshot != self.last_snapshot
+        self.last_snapshot = snapshot
+        rising = level is not None and self.last_level is not None and level > self.last_level
+        if level is not None:
+            self.last_level = level
+        if rising:
+            # Device readings arrive slower than we poll, so hold the fast rate
+            self.fast_until = time.monotonic() + RISING_HOLD
+
+        if emergency or time.monotonic() < self.fast_until:
+            self.interval = FAST_INTERVAL
+            self.unchanged_polls = 0
+        elif changed:
+            self.interval = NORMAL_INTERVAL
+            self.unchanged_polls = 0
+        else:
+            self.unchanged_polls += 1
+            if self.unchanged_polls >= IDLE_AFTER_POLLS:
+                self.interval = min(max(self.interval, NORMAL_INTERVAL) * 2, IDLE_MAX_INTERVAL)
+            else:
+                self.interval = NORMAL_INTERVAL
+
+    def set_visible(self, visible):
+        was_visible = self.visible
+        self.visible = visible
+        if visible and not was_visible:
+            self.unchanged_polls = 0
+            self.interval = NORMAL_INTERVAL
+            self.wake()
+
+    def wake(self):
+        self.wake_event.set()
+
+    def wait(self):
+        self.wake_event.wait(self.interval if self.visible else HIDDEN_INTERVAL)
+        self.wake_event.clear()
+
+
+# Data each tab needs: path, query parameters and the columnar list field
+FEEDS = {
+    "dashboard": ("/dashboard", {"logs": 10, "shape": "columnar"}, "logs"),
+    "logs": ("/logs", {"limit": 20, "shape": "columnar"}, "logs"),
+}
+TAB_FEEDS = ["dashboard", "logs"]
+
+
+class SharedPoller:
+    """One process-wide fetch loop shared by every page session.
+
+    Each session registers the feed its selected tab shows and a callback.
+    The loop fetches only the feeds some session needs, once per cycle, and
+    fans the result out to all of them, so backend traffic does not grow
+    with the number of viewers. Sessions whose callback fails (the page is
+    gone) are dropped, as are sessions that unregister on disconnect.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.latest = {}
+        self.scheduler = RefreshScheduler()
+        self.thread = None
+
+    def register(self, key, feed, callback):
+        with self.lock:
+            self.sessions[key] = {"feed": feed, "visible": True, "callback": callback}
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        self.update_visibility()
+        self.deliver_latest(key, feed)
+        self.scheduler.wake()
+
+    def unregister(self, key):
+        with self.lock:
+            self.sessions.pop(key, None)
+        self.update_visibility()
+
+    def set_feed(self, key, feed):
+        with self.lock:
+            if key not in self.sessions:
+                return
+            self.sessions[key]["feed"] = feed
+        self.deliver_latest(key, feed)
+        self.scheduler.wake()
+
+    def set_visible(self, key, visible):
+        with self.lock:
+            if key not in self.sessions:
+                return
+            self.sessions[key]["visible"] = visible
+        self.update_visibility()
+
+    def update_visibility(self):
+        with self.lock:
+            visible = any(s["visible"] for s in self.sessions.values())
+        self.scheduler.set_visible(visible)
+
+    def wake(self):
+        self.scheduler.wake()
+
+    def deliver_latest(self, key, feed):
+        # A new or switching session renders the last result without waiting
+        if feed in self.latest:
+            self.deliver(feed, self.latest[feed], None, only=key)
+
+    def deliver(self, feed, payload, error, only=None):
+        with self.lock:
+            targets = [(key, s["callback"]) for key, s in self.sessions.items()
+                       if s["feed"] == feed and (only is None or key == only)]
+        for key, callback in targets:
+            try:
+                callback(feed, payload, error)
+            except Exception as ex:
+                print(f"Dropping page session: {ex}")
+                self.unregister(key)
+
+    def fetch(self, feed):
+        path, params, list_key = FEEDS[feed]
+        # Every session waits on this thread, so a stalled request must not hang it
+        response = http_session().get(f"{SERVER_URL}{path}", params=params, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            raise RuntimeError(f"Error: {response.status_code}")
+        payload = response.json()
+        # Decode the columnar list once here, not once per session
+        payload[list_key] = from_columnar(payload.get(list_key, {}))
+        return payload
+
+    def run(self):
+        while True:
+            with self.lock:
+                sessions = list(self.sessions.values())
+            # Hidden sessions still get updates, at the hidden rate
+            visible = [s for s in sessions if s["visible"]] or sessions
+            feeds = sorted({s["feed"] for s in visible})
+
+            snapshot = {}
+            level, emergency = None, False
+            for feed in feeds:
+                try:
+                    payload = self.fetch(feed)
+                except Exception as ex:
+                    self.deliver(feed, None, str(ex))
+                    continue
+                self.latest[feed] = payload
+                self.deliver(feed, payload, None)
+
+                if feed == "dashboard":
+                    esp_d = payload.get("esp", {})
+                    level = esp_d.get("danger_level", 0)
+                    emergency = esp_d.get("emergency", False)
+                    reading = {k: v for k, v in esp_d.items() if k != "timestamp"}
+                    snapshot[feed] = (reading, payload["logs"])
+                else:
+                    # /logs carries the current state too, so the rate still
+                    # follows emergencies when no session shows the dashboard
+                    if level is None:
+                        level = payload.get("danger_level")
+                        emergency = payload.get("emergency", False)
+                    snapshot[feed] = payload["logs"]
+
+            if feeds:
+                self.scheduler.observe(snapshot, level, emergency)
+            self.scheduler.wait()
+
+
+poller = SharedPoller()
+
+
+def new_trace():
+    # Trace fields the backend uses to time a command from click to actuation
+    return {"trace_id": uuid.uuid4().hex[:12], "t_click": time.time()}
+
+
+def send_command(command, state, trace):
+    path, field = COMMANDS[command]
+    try:
+        response = http_session().post(f"{SERVER_URL}{path}", json={field: state, **trace},
+                                       timeout=REQUEST_TIMEOUT)
+        return response.status_code == 200
+    except requests.RequestException as ex:
+        print(f"Error sending {command} command: {ex}")
+        return False
+
+
+class CommandDispatcher:
+    """Sends dashboard commands from a background worker.
+
+    submit() records the state the operator wants and returns at once, so
+    the click handler never blocks. A burst of clicks while a command is in
+    flight collapses into one follow-up carrying only the final state.
+    display() tells the UI what to show for a command: the intended state
+    while it is pending or held, otherwise what the backend reports.
+    on_result(command, state, ok) is called after each send.
+    """
+
+    def __init__(self, on_result):
+        self.on_result = on_result
+        self.lock = threading.Lock()
+        self.queued = {}
+        self.in_flight = {}
+        self.holds = {}
+        self.thread = None
+
+    def submit(self, command, state):
+        with self.lock:
+            self.queued[command] = (state, new_trace())
+            self.holds.pop(command, None)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def pending(self, command):
+        with self.lock:
+            return command in self.queued or command in self.in_flight
+
+    def display(self, command, observed):
+        with self.lock:
+            if command in self.queued:
+                return self.queued[command][0]
+            if command in self.in_flight:
+                return self.in_flight[command]
+            hold = self.holds.get(command)
+            if hold is not None:
+                state, deadline = hold
+                if observed != state and time.monotonic() < deadline:
+                    return state
+                del self.holds[command]
+            return observed
+
+    def run(self):
+        try:
+            while True:
+                with self.lock:
+                    if not self.queued:
+                        self.thread = None
+                        return
+                    command, (state, trace) = self.queued.popitem()
+                    self.in_flight[command] = state
+
+                try:
+                    ok = send_command(command, state, trace)
+                except Exception as ex:
+                    print(f"Error sending {command} command: {ex}")
+                    ok = False
+
+                with self.lock:
+                    del self.in_flight[command]
+                    if ok and command not in self.queued:
+                        self.holds[command] = (state, time.monotonic() + COMMAND_HOLD)
+                try:
+                    self.on_result(command, state, ok)
+                except Exception as ex:
+                    # e.g. the page is disconnecting; later clicks must still be sent
+                    print(f"Error showing {command} result: {ex}")
+        finally:
+            # An unexpected error must not leave the worker marked as running
+            with self.lock:
+                if self.thread is threading.current_thread():
+                    self.thread = None
+                    if self.queued:
+                        self.thread = threading.Thread(target=self.run, daemon=True)
+                        self.thread.start()
+
+
 def main(page: ft.Page):
     page.title = "ESP32 Emergency System Dashboard"
     page.vertical_alignment = "center"
@@ -13,6 +401,10 @@ def main(page: ft.Page):
     page.theme_mode = ft.ThemeMode.LIGHT
     page.padding = 20
 
+    vm = ViewModel(page)
+    # Last command states reported by the backend, for rolling back
+    observed = {"emergency": False, "servo": False}
+
     # Danger Level Indicator
     danger_level = ft.Text("0%", size=50, weight="bold")
     danger_status = ft.Text("Normal", size=30, weight="bold")
@@ -81,169 +473,153 @@ def main(page: ft.Page):
     esp_status_text = ft.Text("Waiting for ESP32 data...")
 
     def update_danger_indicator(level, emergency):
-        danger_level.value = f"{level}%"
-        
+        vm.set(danger_level, "value", f"{level}%")
+
         if emergency:
-            danger_status.value = "EMERGENCY!"
-            danger_gauge.bgcolor = ft.Colors.YELLOW
-            emergency_status.value = "EMERGENCY MODE ACTIVE"
-            emergency_button.style.bgcolor = ft.Colors.RED_700
-            emergency_button.text = "🚨 EMERGENCY"
+            status, gauge_color = "EMERGENCY!", ft.Colors.YELLOW
         elif level > 70:
-            danger_status.value = "DANGER!"
-            danger_gauge.bgcolor = ft.Colors.RED
-            emergency_status.value = "System Normal"
-            emergency_button.style.bgcolor = ft.Colors.GREEN_700
-            emergency_button.text = "✅ SYSTEM NORMAL"
+            status, gauge_color = "DANGER!", ft.Colors.RED
         elif level > 40:
-            danger_status.value = "Warning"
-            danger_gauge.bgcolor = ft.Colors.BLUE
-            emergency_status.value = "System Normal"
-            emergency_button.style.bgcolor = ft.colors.GREEN_700
-            emergency_button.text = "✅ SYSTEM NORMAL"
+            status, gauge_color = "Warning", ft.Colors.BLUE
         else:
-            danger_status.value = "Normal"
-            danger_gauge.bgcolor = ft.Colors.GREEN
-            emergency_status.value = "System Normal"
-            emergency_button.style.bgcolor = ft.Colors.GREEN_700
-            emergency_button.text = "✅ SYSTEM NORMAL"
+            status, gauge_color = "Normal", ft.Colors.GREEN
 
-        page.update()
+        vm.set(danger_status, "value", status)
+        vm.set(danger_gauge, "bgcolor", gauge_color)
+        set_emergency_button(dispatcher.display("emergency", emergency))
+        vm.set(emergency_status, "value", "EMERGENCY MODE ACTIVE" if emergency else "System Normal")
 
-    def refresh_status():
-        try:
-            response = requests.get(f"{SERVER_URL}/dashboard")
-            if response.status_code == 200:
-                dashboard = response.json()
-                esp_d = dashboard.get("esp", {})
-                logs = dashboard.get("logs", [])
-
-                # Update Indicators
-                danger_lvl = esp_d.get("danger_level", 0)
-                emergency = esp_d.get("emergency", False)
-                update_danger_indicator(danger_lvl, emergency)
-
-                # Update ESP Status Text
-                esp_status_text.value = (
-                    f"Potentiometer: {esp_d.get('analog_input', 0)}\n"
-                    f"Danger Level: {danger_lvl}%\n"
-                    f"Red LED: {'ON' if danger_lvl > 70 else 'OFF'}\n"
-                    f"Blue LED: {'ON' if danger_lvl > 40 else 'OFF'}\n"
-                    f"Buzzer: {'ON' if danger_lvl > 70 or emergency else 'OFF'}\n"
-                    f"Emergency LED: {'ON' if emergency else 'OFF'}\n"
-                    f"Door: {'OPEN' if esp_d.get('servo_open', False) else 'CLOSED'}\n"
-                    f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+    def set_emergency_button(emergency):
+        if emergency:
+            vm.set(emergency_button, "style.bgcolor", ft.Colors.RED_700)
+            vm.set(emergency_button, "text", "🚨 EMERGENCY")
+        else:
+            vm.set(emergency_button, "style.bgcolor", ft.Colors.GREEN_700)
+            vm.set(emergency_button, "text", "✅ SYSTEM NORMAL")
+
+    def set_servo_button(servo_open):
+        vm.set(servo_button, "text", "🔓 Open Door" if servo_open else "🔒 Close Door")
+
+    def render_logs(display, logs):
+        # Rebuild a log list only when its entries changed
+        def rebuild():
+            rows = []
+            for log in reversed(logs):
+                danger_lvl = log.get("danger_level", 0)
+                emergency = log.get("emergency", False)
+
+                log_color = ft.Colors.RED if danger_lvl > 70 else (
+                    ft.Colors.BLUE if danger_lvl > 40 else ft.Colors.GREEN
                 )
+                if emergency:
+                    log_color = ft.Colors.YELLOW
 
-                # Update Servo Button
-                if esp_d.get('servo_open', False):
-                    servo_button.text = "🔓 Open Door"
-                else:
-                    servo_button.text = "🔒 Close Door"
-
-                # Update Current Logs
-                current_log_display.controls = []
-                for log in reversed(logs[-10:]):
-                    danger_lvl = log.get("danger_level", 0)
-                    emergency = log.get("emergency", False)
-                    
-                    log_color = ft.Colors.RED if danger_lvl > 70 else (
-                        ft.colors.BLUE if danger_lvl > 40 else ft.Colors.GREEN
-                    )
-                    if emergency:
-                        log_color = ft.Colors.YELLOW
-                    
-                    current_log_display.controls.append(
-                        ft.Text(
-                            f"{log.get('time', '')} - {log.get('event', '')} "
-                            f"(Danger: {danger_lvl}%)",
-                            color=log_color
-                        )
+                rows.append(
+                    ft.Text(
+                        f"{log.get('time', '')} - {log.get('event', '')} "
+                        f"(Danger: {danger_lvl}%)",
+                        color=log_color
                     )
+                )
+            display.controls = rows
 
-                # Update Historical Logs
-                historical_log_display.controls = []
-                for log in reversed(logs):
-                    danger_lvl = log.get("danger_level", 0)
-                    emergency = log.get("emergency", False)
-                    
-                    log_color = ft.Colors.RED if danger_lvl > 70 else (
-                        ft.colors.BLUE if danger_lvl > 40 else ft.Colors.GREEN
-                    )
-                    if emergency:
-                        log_color = ft.Colors.YELLOW
-                    
-                    historical_log_display.controls.append(
-                        ft.Text(
-                            f"{log.get('time', '')} - {log.get('event', '')} "
-                            f"(Danger: {danger_lvl}%)",
-                            color=log_color
-                        )
-                    )
+        vm.changed(display, "logs", logs, rebuild)
 
-            else:
-                esp_status_text.value = f"Error: {response.status_code}"
-        except Exception as ex:
-            esp_status_text.value = f"Exception: {str(ex)}"
+    def show_dashboard(dashboard):
+        esp_d = dashboard.get("esp", {})
+        logs = dashboard.get("logs", [])
+
+        # Update Indicators
+        danger_lvl = esp_d.get("danger_level", 0)
+        emergency = esp_d.get("emergency", False)
+        observed["emergency"] = emergency
+        observed["servo"] = esp_d.get("servo_open", False)
+        update_danger_indicator(danger_lvl, emergency)
 
-        page.update()
+        # Update ESP Status Text
+        vm.set(esp_status_text, "value", (
+            f"Potentiometer: {esp_d.get('analog_input', 0)}\n"
+            f"Danger Level: {danger_lvl}%\n"
+            f"Red LED: {'ON' if danger_lvl > 70 else 'OFF'}\n"
+            f"Blue LED: {'ON' if danger_lvl > 40 else 'OFF'}\n"
+            f"Buzzer: {'ON' if danger_lvl > 70 or emergency else 'OFF'}\n"
+            f"Emergency LED: {'ON' if emergency else 'OFF'}\n"
+            f"Door: {'OPEN' if esp_d.get('servo_open', False) else 'CLOSED'}\n"
+            f"Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+        ))
+
+        # Update Servo Button
+        set_servo_button(dispatcher.display("servo", esp_d.get("servo_open", False)))
+
+        # Update Current Logs
+        render_logs(current_log_display, logs[-10:])
+
+    def show_feed(feed, payload, error):
+        # Called from the shared poller for this session's selected tab
+        if error:
+            vm.set(esp_status_text, "value", error)
+        elif feed == "dashboard":
+            show_dashboard(payload)
+        else:
+            render_logs(historical_log_display, payload.get("logs", []))
+        vm.flush()
 
     def emergency_click(e):
-        try:
-            current_text = emergency_button.text
-            new_state = current_text == "✅ SYSTEM NORMAL"
-            
-            response = requests.post(
-                f"{SERVER_URL}/flet/emergency", 
-                json={"emergency": new_state}
-            )
-            
-            if response.status_code == 200:
-                if new_state:
-                    emergency_button.text = "🚨 EMERGENCY"
-                    emergency_button.style.bgcolor = ft.Colors.RED_700
-                else:
-                    emergency_button.text = "✅ SYSTEM NORMAL"
-                    emergency_button.style.bgcolor = ft.Colors.GREEN_700
-                page.update()
-                
-                refresh_status()
-        except Exception as ex:
-            print(f"Error sending emergency state: {ex}")
-            esp_status_text.value = f"Error: {str(ex)}"
-            page.update()
+        # Show the new state at once; the command is sent in the background
+        new_state = emergency_button.text == "✅ SYSTEM NORMAL"
+        set_emergency_button(new_state)
+        vm.flush()
+        dispatcher.submit("emergency", new_state)
 
     def servo_click(e):
-        try:
-            current_text = servo_button.text
-            new_state = "🔓 Open Door" if "Close" in current_text else "🔒 Close Door"
-            
-            response = requests.post(
-                f"{SERVER_URL}/esp/servo", 
-                json={"servo_open": "Open" in new_state}
-            )
-            
-            if response.status_code == 200:
-                servo_button.text = new_state
-                page.update()
-                
-                refresh_status()
-        except Exception as ex:
-            print(f"Error sending servo state: {ex}")
-            esp_status_text.value = f"Error: {str(ex)}"
-            page.update()
-
-    def auto_refresh():
-        while True:
-            refresh_status()
-            time.sleep(0.5)
+        new_state = "Close" in servo_button.text
+        set_servo_button(new_state)
+        vm.flush()
+        dispatcher.submit("servo", new_state)
+
+    def command_result(command, state, ok):
+        if ok:
+            # Let every viewer see the result as soon as possible
+            poller.wake()
+            return
+        if dispatcher.pending(command):
+            # A newer click is already on its way and supersedes this one
+            return
+        # Rejected: roll back to what the backend last reported
+        if command == "emergency":
+            set_emergency_button(observed["emergency"])
+        else:
+            set_servo_button(observed["servo"])
+        vm.flush()
+        page.open(ft.SnackBar(ft.Text(f"{command.capitalize()} command failed; change reverted")))
+
+    def tab_changed(e):
+        # Switch this session to the newly selected tab's feed
+        poller.set_feed(page.session_id, TAB_FEEDS[tabs.selected_index])
+
+    def lifecycle_changed(e):
+        poller.set_visible(page.session_id, e.state not in (
+            ft.AppLifecycleState.HIDE,
+            ft.AppLifecycleState.PAUSE,
+            ft.AppLifecycleState.DETACH
+        ))
+
+    def session_connected(e):
+        # A web client reconnecting to this session picks up updates again
+        poller.register(page.session_id, TAB_FEEDS[tabs.selected_index], show_feed)
+
+    def session_closed(e):
+        poller.unregister(page.session_id)
+
+    dispatcher = CommandDispatcher(command_result)
 
     # Event Handlers
     emergency_button.on_click = emergency_click
     servo_button.on_click = servo_click
-
-    # Start Auto-Refresh Thread
-    threading.Thread(target=auto_refresh, daemon=True).start()
+    page.on_app_lifecycle_state_change = lifecycle_changed
+    page.on_connect = session_connected
+    page.on_disconnect = session_closed
+    page.on_close = session_closed
 
     # Danger Gauge Content
     danger_gauge.content = ft.Column([danger_level, danger_status], alignment=ft.alignment.center)
@@ -285,13 +661,14 @@ def main(page: ft.Page):
                 )
             )
         ],
-        expand=1
+        expand=1,
+        on_change=tab_changed
     )
 
     # Build UI
     page.add(tabs)
 
-    # Initial Refresh
-    refresh_status()
+    # Join the shared poller (after page.add so partial updates have a target)
+    poller.register(page.session_id, TAB_FEEDS[tabs.selected_index], show_feed)
 
 ft.app(target=main)
\ No newline at end of file
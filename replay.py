@@ -0,0 +1,82 @@
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+SERVER_URL = "http://127.0.0.1:5000"
+
+
+def load_capture(path):
+    # Each line is [unix_time, method, path, body] as written by backend.py.
+    # Read it all up front so replaying into a capturing backend cannot loop.
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(capture, server, speed, workers):
+    session = requests.Session()
+    lock = threading.Lock()
+    stats = {"sent": 0, "errors": 0, "latencies": []}
+
+    def send(method, path, body):
+        started = time.perf_counter()
+        try:
+            response = session.request(method, f"{server}{path}", json=body, timeout=10)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            stats["sent"] += 1
+            stats["latencies"].append(elapsed)
+            if not ok:
+                stats["errors"] += 1
+
+    # Requests are issued from a pool so a slow response does not delay the
+    # ones after it; the schedule follows the captured inter-arrival times.
+    first_time = None
+    replay_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for stamp, method, path, body in capture:
+            if first_time is None:
+                first_time = stamp
+            if speed > 0:
+                due = replay_start + (stamp - first_time) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(send, method, path, body)
+
+    stats["duration"] = time.perf_counter() - replay_start
+    return stats
+
+
+def print_report(stats):
+    latencies = sorted(stats["latencies"])
+    print(f"Sent {stats['sent']} requests in {stats['duration']:.2f}s "
+          f"({stats['errors']} errors)")
+    if latencies:
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"Latency p50 {p50 * 1000:.1f} ms, p99 {p99 * 1000:.1f} ms, "
+              f"max {latencies[-1] * 1000:.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a backend traffic capture")
+    parser.add_argument("capture", help="capture file written with CAPTURE_FILE set")
+    parser.add_argument("--server", default=SERVER_URL)
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="time scale, e.g. 1 or 10; 0 sends as fast as possible")
+    parser.add_argument("--workers", type=int, default=16)
+    args = parser.parse_args()
+
+    stats = replay(load_capture(args.capture), args.server, args.speed, args.workers)
+    print_report(stats)
+
+
+if __name__ == "__main__":
+    main()